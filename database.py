@@ -5,20 +5,51 @@ Database models and operations for the Shopify WhatsApp Launcher app.
 """
 
 import os
-import json
-from typing import Dict, Optional
+import atexit
+import logging
+import mmap
+import threading
+import time
+import orjson
+from typing import Dict, List, Optional
 from datetime import datetime
+from functools import lru_cache
 
 # SQLAlchemy imports
-from sqlalchemy import create_engine, Column, String, Text, DateTime, Integer
+from sqlalchemy import create_engine, Column, String, Text, DateTime, Integer, Boolean, bindparam, delete, false, func, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
+from cachetools import TTLCache
+
+log = logging.getLogger(__name__)
+
+_now_cache = (0, "")
+
+def _now_iso() -> str:
+    """Current local time as an ISO string, formatted at most once per second"""
+    global _now_cache
+    second = int(time.time())
+    if _now_cache[0] != second:
+        _now_cache = (second, datetime.fromtimestamp(second).isoformat())
+    return _now_cache[1]
+
 
 # ---------------------------
 # File-based DB (SimpleFileDB)
 # ---------------------------
 class SimpleFileDB:
+    """
+    In-memory dict backed by a JSON snapshot plus an append-only log.
+    Mutations only touch memory and mark the record dirty; a background
+    thread appends the dirty records to `<db_file>.log` at most every
+    `DB_FLUSH_INTERVAL` seconds, so a burst of clicks becomes one write.
+    Startup loads the snapshot and replays the log. The log is folded back
+    into the snapshot once it grows past `DB_LOG_MAX_BYTES`.
+    """
+
     def __init__(self, db_file: str = None):
         if db_file is None:
             data_dir = os.getenv("DATA_DIR", "/app/data")
@@ -26,64 +57,205 @@ class SimpleFileDB:
             self.db_file = os.path.join(data_dir, "app_data.json")
         else:
             self.db_file = db_file
+        self.log_file = self.db_file + ".log"
+        self.log_max_bytes = int(os.getenv("DB_LOG_MAX_BYTES", 1 << 20))
+        self.flush_interval = float(os.getenv("DB_FLUSH_INTERVAL", 0.25))
+        # DB_FSYNC=0 trades crash durability for much cheaper writes; the
+        # snapshot stays consistent either way thanks to the atomic rename
+        self.fsync = os.getenv("DB_FSYNC", "1") != "0"
         self.data = self._load_data()
-    
+        self._log = open(self.log_file, 'ab', buffering=1 << 16)
+        self._lock = threading.Lock()
+        # Serializes flushes; taken before _lock, never while holding it
+        self._io_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._pending: Dict[tuple, object] = {}
+        threading.Thread(target=self._flush_loop, name="SimpleFileDB-flush", daemon=True).start()
+        atexit.register(self.flush)
+
     def _load_data(self) -> Dict:
+        data = {"installations": {}, "whatsapp_configs": {}, "click_counts": {}, "click_times": {}}
         if os.path.exists(self.db_file):
             try:
-                with open(self.db_file, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
+                # Parse straight out of the page cache instead of copying the file into a bytes object
+                with open(self.db_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        data = orjson.loads(view)
+            except (orjson.JSONDecodeError, FileNotFoundError, ValueError):
+                # ValueError: mmap of an empty file
                 pass
-        return {"installations": {}, "whatsapp_configs": {}, "analytics": {}}
-    
-    def _save_data(self):
+        # Snapshots written before analytics were split into counters and times
+        if "analytics" in data:
+            data["click_counts"], data["click_times"] = {}, {}
+            for shop, analytics in data.pop("analytics").items():
+                self._apply(data, {"op": "analytics", "shop": shop, "value": analytics})
+        if os.path.exists(self.log_file):
+            with open(self.log_file, 'r+b') as f:
+                good = 0
+                for line in f:
+                    # A crash mid-append leaves a torn final line
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        self._apply(data, orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        break
+                    good += len(line)
+                # Cut the log back to the last complete record; otherwise the
+                # next append is glued onto the torn bytes and lost with them
+                f.truncate(good)
+        return data
+
+    @staticmethod
+    def _apply(data: Dict, record: Dict):
+        op, shop, value = record["op"], record["shop"], record["value"]
+        if op == "remove":
+            data["installations"].pop(shop, None)
+            data["whatsapp_configs"].pop(shop, None)
+            data["click_counts"].pop(shop, None)
+            data["click_times"].pop(shop, None)
+        elif op == "analytics":
+            # Legacy per-shop analytics dict
+            data["click_counts"][shop] = value["widget_clicks"]
+            data["click_times"][shop] = [value["first_click"], value["last_click"]]
+        else:
+            data[op][shop] = value
+
+    def _append(self, op: str, shop: str, value=None):
+        # Caller holds self._lock. Later records for the same (op, shop)
+        # replace earlier ones, so only the latest value is written.
+        if op == "remove":
+            for key in [k for k in self._pending if k[1] == shop]:
+                del self._pending[key]
+        self._pending[(op, shop)] = value
+        self._dirty.set()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write pending records to the log, compacting if it grew too large"""
+        # _lock is only held to swap out the pending records (and serialize
+        # them, or the whole state when compacting); the writes and fsync run
+        # under _io_lock so mutators on the request path never wait on disk
+        with self._io_lock:
+            with self._lock:
+                self._dirty.clear()
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+                records = b"".join(
+                    orjson.dumps({"op": op, "shop": shop, "value": value}, default=str) + b"\n"
+                    for (op, shop), value in pending.items()
+                )
+                snapshot = None
+                if self._log.tell() + len(records) > self.log_max_bytes:
+                    snapshot = orjson.dumps(self.data, default=str)
+            try:
+                # Logged even when compacting: if we crash between the snapshot
+                # rename and the log truncation, replaying the log must end on
+                # the same values the snapshot holds
+                self._log.write(records)
+                self._log.flush()
+                if self.fsync:
+                    os.fsync(self._log.fileno())
+                if snapshot is not None:
+                    self.compact(snapshot)
+            except Exception as e:
+                log.warning("Error saving data: %s", e)
+                with self._lock:
+                    # Retry on the next flush. Records queued since then win,
+                    # and a newer remove drops the shop's older records.
+                    removed = {shop for op, shop in self._pending if op == "remove"}
+                    retry = {key: value for key, value in pending.items() if key[1] not in removed}
+                    retry.update(self._pending)
+                    self._pending = retry
+                    self._dirty.set()
+
+    def compact(self, snapshot: bytes):
+        """Replace the snapshot with `snapshot` and truncate the log (caller holds _io_lock)"""
+        tmp_file = self.db_file + ".tmp"
+        # Hand the whole snapshot to the kernel directly; for a state this
+        # small that beats any buffered writer
+        buf = memoryview(snapshot)
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
         try:
-            with open(self.db_file, 'w') as f:
-                json.dump(self.data, f, indent=2, default=str)
-        except Exception as e:
-            print(f"Error saving data: {e}")
-    
+            while buf:
+                buf = buf[os.write(fd, buf):]
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_file, self.db_file)
+        self._log.close()
+        self._log = open(self.log_file, 'wb', buffering=1 << 16)
+
     def save_installation(self, shop: str, access_token: str):
-        self.data["installations"][shop] = {
-            "access_token": access_token,
-            "shop": shop,
-            "installed_at": datetime.now().isoformat()
-        }
-        self._save_data()
+        with self._lock:
+            self.data["installations"][shop] = {
+                "access_token": access_token,
+                "shop": shop,
+                "installed_at": datetime.now().isoformat(),
+                "script_tag_installed": False
+            }
+            self._append("installations", shop, self.data["installations"][shop])
     
     def get_installation(self, shop: str) -> Optional[Dict]:
         return self.data["installations"].get(shop)
     
+    def set_script_tag_installed(self, shop: str, installed: bool):
+        with self._lock:
+            installation = self.data["installations"].get(shop)
+            if installation is not None:
+                installation["script_tag_installed"] = installed
+                self._append("installations", shop, installation)
+    
     def remove_installation(self, shop: str):
-        self.data["installations"].pop(shop, None)
-        self.data["whatsapp_configs"].pop(shop, None)
-        self.data["analytics"].pop(shop, None)
-        self._save_data()
+        with self._lock:
+            self.data["installations"].pop(shop, None)
+            self.data["whatsapp_configs"].pop(shop, None)
+            self.data["click_counts"].pop(shop, None)
+            self.data["click_times"].pop(shop, None)
+            self._append("remove", shop)
     
     def save_whatsapp_config(self, shop: str, phone_number: str, initial_message: str):
-        self.data["whatsapp_configs"][shop] = {
-            "phone_number": phone_number,
-            "initial_message": initial_message,
-            "updated_at": datetime.now().isoformat()
-        }
-        self._save_data()
+        with self._lock:
+            self.data["whatsapp_configs"][shop] = {
+                "phone_number": phone_number,
+                "initial_message": initial_message,
+                "updated_at": datetime.now().isoformat()
+            }
+            self._append("whatsapp_configs", shop, self.data["whatsapp_configs"][shop])
     
     def get_whatsapp_config(self, shop: str) -> Optional[Dict]:
         return self.data["whatsapp_configs"].get(shop)
     
-    def log_widget_click(self, shop: str):
-        if shop not in self.data["analytics"]:
-            self.data["analytics"][shop] = {"widget_clicks": 0, "first_click": None, "last_click": None}
-        self.data["analytics"][shop]["widget_clicks"] += 1
-        now = datetime.now().isoformat()
-        if not self.data["analytics"][shop]["first_click"]:
-            self.data["analytics"][shop]["first_click"] = now
-        self.data["analytics"][shop]["last_click"] = now
-        self._save_data()
+    def log_widget_clicks_bulk(self, clicks: Dict[str, int]):
+        """Add many shops' buffered click counts under a single lock acquisition"""
+        now = _now_iso()
+        with self._lock:
+            click_counts = self.data["click_counts"]
+            click_times = self.data["click_times"]
+            installations = self.data["installations"]
+            for shop, count in clicks.items():
+                # Clicks buffered before an uninstall must not recreate its analytics
+                if shop not in installations:
+                    continue
+                click_counts[shop] = total = click_counts.get(shop, 0) + count
+                times = click_times.get(shop)
+                if times is None:
+                    times = click_times[shop] = [now, now]
+                else:
+                    times[1] = now
+                self._append("click_counts", shop, total)
+                self._append("click_times", shop, times)
     
     def get_analytics(self, shop: str) -> Optional[Dict]:
-        return self.data["analytics"].get(shop, {"widget_clicks": 0, "first_click": None, "last_click": None})
+        first_click, last_click = self.data["click_times"].get(shop, (None, None))
+        return {"widget_clicks": self.data["click_counts"].get(shop, 0), "first_click": first_click, "last_click": last_click}
     
     def get_all_installations(self) -> Dict:
         return self.data["installations"]
@@ -99,6 +271,8 @@ class Installation(Base):
     shop = Column(String, primary_key=True)
     access_token = Column(Text, nullable=False)
     installed_at = Column(DateTime, default=datetime.utcnow)
+    # Set once the storefront script tag exists, so config saves skip the Shopify call
+    script_tag_installed = Column(Boolean, nullable=False, default=False, server_default=false())
 
 class WhatsAppConfig(Base):
     __tablename__ = "whatsapp_configs"
@@ -115,12 +289,142 @@ class Analytics(Base):
     last_click = Column(DateTime, nullable=True)
 
 
+@lru_cache(maxsize=4096)
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    # Stored timestamps rarely change, so repeated reads of the same row
+    # reuse the formatted string instead of calling isoformat() each time
+    return value.isoformat() if value else None
+
+def _installation_dict(obj) -> Dict:
+    """Cache/API form of an installations row"""
+    return {"shop": obj.shop, "access_token": obj.access_token, "installed_at": _isoformat(obj.installed_at), "script_tag_installed": obj.script_tag_installed}
+
+
+# Core SELECTs for the read path: no identity map, unit of work or
+# commit/rollback bookkeeping, and the compiled form is cached by SQLAlchemy
+_SELECT_ALL_INSTALLATIONS = select(
+    Installation.shop, Installation.access_token, Installation.installed_at, Installation.script_tag_installed
+)
+_SELECT_INSTALLATION = _SELECT_ALL_INSTALLATIONS.where(Installation.shop == bindparam("shop"))
+_SELECT_WHATSAPP_CONFIG = select(
+    WhatsAppConfig.phone_number, WhatsAppConfig.initial_message, WhatsAppConfig.updated_at
+).where(WhatsAppConfig.shop == bindparam("shop"))
+_SELECT_ANALYTICS = select(
+    Analytics.widget_clicks, Analytics.first_click, Analytics.last_click
+).where(Analytics.shop == bindparam("shop"))
+
+# Flushed click counts arrive as parallel shop/count arrays. Joining them to
+# installations inside the INSERT drops shops uninstalled since the clicks
+# were buffered, in the same statement as the write. Rows go in shop order,
+# so workers flushing overlapping shops lock them in the same order and
+# can't deadlock.
+_clicks = func.unnest(
+    bindparam("shops", type_=ARRAY(String)), bindparam("counts", type_=ARRAY(Integer))
+).table_valued("shop", "widget_clicks").render_derived()
+_insert_clicks = pg_insert(Analytics).from_select(
+    ["shop", "widget_clicks", "first_click", "last_click"],
+    select(Installation.shop, _clicks.c.widget_clicks, bindparam("now", type_=DateTime), bindparam("now", type_=DateTime))
+    .join_from(_clicks, Installation, Installation.shop == _clicks.c.shop)
+    .order_by(Installation.shop),
+)
+_UPSERT_CLICKS = _insert_clicks.on_conflict_do_update(
+    index_elements=[Analytics.shop],
+    set_={
+        "widget_clicks": Analytics.widget_clicks + _insert_clicks.excluded.widget_clicks,
+        "first_click": func.coalesce(Analytics.first_click, _insert_clicks.excluded.first_click),
+        "last_click": func.greatest(Analytics.last_click, _insert_clicks.excluded.last_click),
+    },
+)
+
+
+class ReadCache:
+    """
+    Short-TTL cache for point lookups in front of the database.
+    Uses Redis when REDIS_URL is set (shared across workers), otherwise an
+    in-process TTLCache. Redis errors degrade to a cache miss.
+    """
+
+    def __init__(self, ttl: int = 60, maxsize: int = 10_000):
+        self.ttl = ttl
+        self.redis = None
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url)
+        else:
+            self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+            self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        if self.redis is None:
+            with self.lock:
+                return self.local.get(key)
+        try:
+            raw = self.redis.get(key)
+        except Exception as e:
+            log.warning("Error reading cache: %s", e)
+            return None
+        return orjson.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Dict):
+        if self.redis is None:
+            with self.lock:
+                self.local[key] = value
+            return
+        try:
+            self.redis.setex(key, self.ttl, orjson.dumps(value))
+        except Exception as e:
+            log.warning("Error writing cache: %s", e)
+
+    def delete(self, *keys: str):
+        if self.redis is None:
+            with self.lock:
+                for key in keys:
+                    self.local.pop(key, None)
+            return
+        try:
+            self.redis.delete(*keys)
+        except Exception as e:
+            log.warning("Error invalidating cache: %s", e)
+
+
 class SQLAlchemyDB:
     def __init__(self):
         db_url = os.getenv("DATABASE_URL")  # Supabase/Postgres connection string
-        self.engine = create_engine(db_url, pool_pre_ping=True)
+        self.engine = self._create_engine(db_url)
+        # Optional read replica for the get_* methods; defaults to the primary
+        read_db_url = os.getenv("READ_DATABASE_URL")
+        self.read_engine = self._create_engine(read_db_url) if read_db_url else self.engine
         Base.metadata.create_all(self.engine)
+        # create_all doesn't add columns to tables that already exist
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE installations ADD COLUMN IF NOT EXISTS "
+                "script_tag_installed BOOLEAN NOT NULL DEFAULT FALSE"
+            ))
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.cache = ReadCache(ttl=int(os.getenv("DB_CACHE_TTL", 60)))
+
+    @staticmethod
+    def _create_engine(db_url: str):
+        workers = max(1, int(os.getenv("WEB_CONCURRENCY", 2)))
+        # Cap rows per multi-VALUES INSERT so huge batches don't balloon memory
+        engine_kwargs = {
+            "pool_pre_ping": True,
+            "insertmanyvalues_page_size": 1000,
+            # Sized for concurrent click logging, with the default budget of
+            # 20 + 40 connections split across the WEB_CONCURRENCY workers,
+            # each of which has its own pool. LIFO keeps a few hot connections
+            # warm and recycling drops connections before Supabase idles them out
+            "pool_size": int(os.getenv("DB_POOL_SIZE", max(1, 20 // workers))),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 40 // workers)),
+            "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+            "pool_use_lifo": True,
+        }
+        if make_url(db_url).get_dialect().driver == "psycopg2":
+            # Route executemany() through psycopg2's fast execution helpers
+            engine_kwargs.update(executemany_mode="values_plus_batch", executemany_batch_page_size=1000)
+        return create_engine(db_url, **engine_kwargs)
 
     @contextmanager
     def session(self):
@@ -135,67 +439,139 @@ class SQLAlchemyDB:
             session.close()
 
     def save_installation(self, shop: str, access_token: str):
+        now = datetime.utcnow()
+        stmt = pg_insert(Installation).values(shop=shop, access_token=access_token, installed_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Installation.shop],
+            # A fresh OAuth grant means the app was (re)installed and Shopify
+            # removed any script tags along with the previous install
+            set_={"access_token": access_token, "installed_at": now, "script_tag_installed": False},
+        )
         with self.session() as db:
-            obj = db.get(Installation, shop)
-            if obj:
-                obj.access_token = access_token
-                obj.installed_at = datetime.utcnow()
-            else:
-                db.add(Installation(shop=shop, access_token=access_token))
+            db.execute(stmt)
+        # Write through rather than invalidate, so a lagging replica can't
+        # repopulate the cache with the pre-save row
+        self.cache.set(f"install:{shop}", {"shop": shop, "access_token": access_token, "installed_at": now.isoformat(), "script_tag_installed": False})
     
     def get_installation(self, shop: str) -> Optional[Dict]:
-        with self.session() as db:
-            obj = db.get(Installation, shop)
+        cached = self.cache.get(f"install:{shop}")
+        if cached is not None:
+            return cached or None
+        with self.read_engine.connect() as conn:
+            obj = conn.execute(_SELECT_INSTALLATION, {"shop": shop}).first()
             if obj:
-                return {"shop": obj.shop, "access_token": obj.access_token, "installed_at": obj.installed_at.isoformat()}
+                row = _installation_dict(obj)
+                self.cache.set(f"install:{shop}", row)
+                return row
         return None
 
+    def set_script_tag_installed(self, shop: str, installed: bool):
+        stmt = (
+            update(Installation).where(Installation.shop == shop).values(script_tag_installed=installed)
+            .returning(*_SELECT_ALL_INSTALLATIONS.selected_columns)
+        )
+        with self.session() as db:
+            obj = db.execute(stmt).first()
+        if obj:
+            self.cache.set(f"install:{shop}", _installation_dict(obj))
+
     def remove_installation(self, shop: str):
+        # Data-modifying CTEs let Postgres run all three deletes in one round trip
+        stmt = (
+            delete(Analytics).where(Analytics.shop == shop)
+            .add_cte(delete(Installation).where(Installation.shop == shop).cte("del_installation"))
+            .add_cte(delete(WhatsAppConfig).where(WhatsAppConfig.shop == shop).cte("del_whatsapp_config"))
+        )
         with self.session() as db:
-            db.query(Installation).filter_by(shop=shop).delete()
-            db.query(WhatsAppConfig).filter_by(shop=shop).delete()
-            db.query(Analytics).filter_by(shop=shop).delete()
+            db.execute(stmt)
+        # Cache empty tombstones instead of deleting the keys, so a lagging
+        # replica can't put the revoked token back; a reinstall overwrites them
+        self.cache.set(f"install:{shop}", {})
+        self.cache.set(f"wa:{shop}", {})
     
     def save_whatsapp_config(self, shop: str, phone_number: str, initial_message: str):
+        now = datetime.utcnow()
+        stmt = pg_insert(WhatsAppConfig).values(
+            shop=shop, phone_number=phone_number, initial_message=initial_message, updated_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[WhatsAppConfig.shop],
+            set_={"phone_number": phone_number, "initial_message": initial_message, "updated_at": now},
+        )
         with self.session() as db:
-            obj = db.get(WhatsAppConfig, shop)
-            if obj:
-                obj.phone_number = phone_number
-                obj.initial_message = initial_message
-                obj.updated_at = datetime.utcnow()
-            else:
-                db.add(WhatsAppConfig(shop=shop, phone_number=phone_number, initial_message=initial_message))
+            db.execute(stmt)
+        self.cache.set(f"wa:{shop}", {"phone_number": phone_number, "initial_message": initial_message, "updated_at": now.isoformat()})
     
     def get_whatsapp_config(self, shop: str) -> Optional[Dict]:
-        with self.session() as db:
-            obj = db.get(WhatsAppConfig, shop)
+        cached = self.cache.get(f"wa:{shop}")
+        if cached is not None:
+            return cached or None
+        with self.read_engine.connect() as conn:
+            obj = conn.execute(_SELECT_WHATSAPP_CONFIG, {"shop": shop}).first()
             if obj:
-                return {"phone_number": obj.phone_number, "initial_message": obj.initial_message, "updated_at": obj.updated_at.isoformat()}
+                row = {"phone_number": obj.phone_number, "initial_message": obj.initial_message, "updated_at": _isoformat(obj.updated_at)}
+                self.cache.set(f"wa:{shop}", row)
+                return row
         return None
 
-    def log_widget_click(self, shop: str):
-        now = datetime.utcnow()
-        with self.session() as db:
-            obj = db.get(Analytics, shop)
-            if obj:
-                obj.widget_clicks += 1
-                obj.last_click = now
-                if not obj.first_click:
-                    obj.first_click = now
-            else:
-                db.add(Analytics(shop=shop, widget_clicks=1, first_click=now, last_click=now))
+    def log_widget_clicks_bulk(self, clicks: Dict[str, int]):
+        """Add many shops' buffered click counts in one upsert"""
+        if not clicks:
+            return
+        # A Core connection: Session.execute would take the parameter dict
+        # for an ORM bulk INSERT of Analytics rows
+        with self.engine.begin() as conn:
+            conn.execute(_UPSERT_CLICKS, {"shops": list(clicks), "counts": list(clicks.values()), "now": datetime.utcnow()})
     
     def get_analytics(self, shop: str) -> Optional[Dict]:
-        with self.session() as db:
-            obj = db.get(Analytics, shop)
+        with self.read_engine.connect() as conn:
+            obj = conn.execute(_SELECT_ANALYTICS, {"shop": shop}).first()
             if obj:
-                return {"widget_clicks": obj.widget_clicks, "first_click": obj.first_click.isoformat() if obj.first_click else None, "last_click": obj.last_click.isoformat() if obj.last_click else None}
+                return {"widget_clicks": obj.widget_clicks, "first_click": _isoformat(obj.first_click), "last_click": _isoformat(obj.last_click)}
         return {"widget_clicks": 0, "first_click": None, "last_click": None}
 
-    def get_all_installations(self) -> Dict:
+    def bulk_save_installations(self, rows: List[Dict]):
+        """Upsert many installations ({"shop", "access_token"[, "installed_at"]}) in one statement"""
+        if not rows:
+            return
+        stmt = pg_insert(Installation).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Installation.shop],
+            # A fresh token means a reinstall, as in save_installation
+            set_={
+                "access_token": stmt.excluded.access_token,
+                "installed_at": stmt.excluded.installed_at,
+                "script_tag_installed": False,
+            },
+        ).returning(*_SELECT_ALL_INSTALLATIONS.selected_columns)
         with self.session() as db:
-            objs = db.query(Installation).all()
-            return {o.shop: {"shop": o.shop, "access_token": o.access_token, "installed_at": o.installed_at.isoformat()} for o in objs}
+            saved = db.execute(stmt).all()
+        # Write the stored rows through, as save_installation does, so
+        # cached lookups don't keep serving replaced access tokens
+        for obj in saved:
+            self.cache.set(f"install:{obj.shop}", _installation_dict(obj))
+
+    def bulk_upsert_analytics(self, rows: List[Dict]):
+        """Merge many analytics rows ({"shop", "widget_clicks", "first_click", "last_click"}) in one statement.
+        Click counts are added to the stored totals rather than replacing them."""
+        if not rows:
+            return
+        stmt = pg_insert(Analytics).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Analytics.shop],
+            set_={
+                "widget_clicks": Analytics.widget_clicks + stmt.excluded.widget_clicks,
+                "first_click": func.coalesce(Analytics.first_click, stmt.excluded.first_click),
+                "last_click": func.greatest(Analytics.last_click, stmt.excluded.last_click),
+            },
+        )
+        with self.session() as db:
+            db.execute(stmt)
+
+    def get_all_installations(self) -> Dict:
+        with self.read_engine.connect() as conn:
+            objs = conn.execute(_SELECT_ALL_INSTALLATIONS)
+            return {o.shop: _installation_dict(o) for o in objs}
 
 
 # ---------------------------
@@ -8,10 +8,13 @@ import os
 import sys
 import json
 import subprocess
+import yaml
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 def check_files():
     """Check if all required files exist"""
+    messages = []
     required_files = [
         'main.py',
         'requirements.txt',
@@ -23,57 +26,62 @@ def check_files():
         'templates/install_embedded.html'
     ]
     
-    missing_files = []
-    for file in required_files:
-        if not Path(file).exists():
-            missing_files.append(file)
+    # One directory scan per parent instead of a stat() per file
+    present = set()
+    for directory in {os.path.dirname(file) or '.' for file in required_files}:
+        if os.path.isdir(directory):
+            with os.scandir(directory) as entries:
+                present.update(os.path.normpath(os.path.join(directory, e.name)) for e in entries)
+    missing_files = [file for file in required_files if os.path.normpath(file) not in present]
     
     if missing_files:
-        print("❌ Missing required files:")
-        for file in missing_files:
-            print(f"   - {file}")
-        return False
+        messages.append("❌ Missing required files:")
+        messages.extend(f"   - {file}" for file in missing_files)
+        return False, messages
     
-    print("✅ All required files present")
-    return True
+    messages.append("✅ All required files present")
+    return True, messages
 
 def check_environment():
     """Check environment configuration"""
+    messages = []
     env_file = Path('.env')
     if not env_file.exists():
-        print("⚠️  .env file not found")
-        return False
+        messages.append("⚠️  .env file not found")
+        return False, messages
     
+    # Stream line by line and stop at the first placeholder
     with open('.env', 'r') as f:
-        content = f.read()
+        has_placeholder = any('your_shopify_api_key_here' in line for line in f)
     
-    if 'your_shopify_api_key_here' in content:
-        print("⚠️  Please update your Shopify API credentials in .env file")
-        return False
+    if has_placeholder:
+        messages.append("⚠️  Please update your Shopify API credentials in .env file")
+        return False, messages
     
-    print("✅ Environment configuration looks good")
-    return True
+    messages.append("✅ Environment configuration looks good")
+    return True, messages
 
 def check_git():
     """Check if git repository is initialized"""
+    messages = []
     if not Path('.git').exists():
-        print("⚠️  Git repository not initialized")
-        print("   Run: git init")
-        return False
+        messages.append("⚠️  Git repository not initialized")
+        messages.append("   Run: git init")
+        return False, messages
     
     try:
         result = subprocess.run(['git', 'status', '--porcelain'], 
                               capture_output=True, text=True)
         if result.stdout.strip():
-            print("⚠️  You have uncommitted changes")
-            print("   Run: git add . && git commit -m 'Prepare for deployment'")
-            return False
+            messages.append("⚠️  You have uncommitted changes")
+            messages.append("   Run: git add . && git commit -m 'Prepare for deployment'")
+            return False, messages
     except FileNotFoundError:
-        print("⚠️  Git not found in PATH")
-        return False
+        messages.append("⚠️  Git not found in PATH")
+        return False, messages
     
-    print("✅ Git repository is ready")
-    return True
+    messages.append("✅ Git repository is ready")
+    return True, messages
 
 def generate_render_config():
     """Generate render.yaml with current settings"""
@@ -99,30 +107,8 @@ def generate_render_config():
         }]
     }
     
-    # Convert to YAML format (simple conversion)
-    yaml_content = """services:
-  - type: web
-    name: shopify-whatsapp-launcher
-    env: python
-    buildCommand: pip install -r requirements.txt
-    startCommand: python main.py
-    envVars:
-      - key: SHOPIFY_API_KEY
-        sync: false
-      - key: SHOPIFY_API_SECRET
-        sync: false
-      - key: APP_URL
-        value: https://shopify-whatsapp-launcher.onrender.com
-      - key: PORT
-        value: 8000
-    healthCheckPath: /health
-    disk:
-      name: app-data
-      mountPath: /app/data
-      sizeGB: 1"""
-    
-    with open('render.yaml', 'w') as f:
-        f.write(yaml_content)
+    with open('render.yaml', 'w', buffering=1 << 16) as f:
+        yaml.safe_dump(config, f, sort_keys=False, default_flow_style=False)
     
     print("✅ render.yaml updated")
 
@@ -149,17 +135,15 @@ def main():
     print("🔧 Shopify WhatsApp Launcher - Deployment Preparation")
     print("=" * 55)
     
-    # Check all requirements
-    checks_passed = True
-    
-    if not check_files():
-        checks_passed = False
-    
-    if not check_environment():
-        checks_passed = False
-    
-    if not check_git():
-        checks_passed = False
+    # Check all requirements; they are independent and I/O-bound (filesystem
+    # and the git subprocess), so run them concurrently. Each returns its
+    # messages, printed afterwards in check order so output doesn't interleave.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(lambda check: check(), [check_files, check_environment, check_git]))
+    for _, messages in results:
+        for message in messages:
+            print(message)
+    checks_passed = all(passed for passed, _ in results)
     
     if not checks_passed:
         print("\n❌ Please fix the issues above before deploying")
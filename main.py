@@ -1,32 +1,42 @@
-from fastapi import FastAPI, Request, Form, HTTPException, Header
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Form, HTTPException, Header, Depends, BackgroundTasks
+from fastapi.responses import HTMLResponse, RedirectResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import logging
+import logging.handlers
+import queue
+import sys
 from dotenv import load_dotenv
 import hmac
 import hashlib
 import base64
-import json
-import requests
+import time
+import re
+import orjson
+import httpx
 import jwt
 from datetime import datetime
 from urllib.parse import urlencode, parse_qs, unquote
-from typing import Optional
+from typing import Dict, Optional
+from collections import Counter
+import asyncio
+from cachetools import TTLCache
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Add CORS middleware for embedded app
 # For embedded apps, we need to allow Shopify's domains
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact Shopify domains
+    allow_origin_regex=r"https://([a-z0-9-]+\.)?(myshopify\.com|shopify\.com)",
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
 # Mount static files
@@ -41,49 +51,256 @@ SHOPIFY_API_SECRET = os.getenv("SHOPIFY_API_SECRET")
 SHOPIFY_SCOPES = "read_themes,write_themes,read_script_tags,write_script_tags"
 APP_URL = os.getenv("APP_URL", "http://localhost:8000")
 
+# Fail at startup instead of on the first request that needs them
+_missing_env = [name for name in ("SHOPIFY_API_KEY", "SHOPIFY_API_SECRET") if not os.getenv(name)]
+if _missing_env:
+    raise RuntimeError(f"Missing required environment variables: {', '.join(_missing_env)}")
+
+# Admin API endpoints (called with the shop domain) and app URLs, built once
+_GRAPHQL_URL = "https://{}/admin/api/2023-10/graphql.json".format
+_SCRIPT_TAGS_URL = "https://{}/admin/api/2023-10/script_tags.json".format
+_OAUTH_REDIRECT_URI = f"{APP_URL}/auth/callback"
+_WIDGET_LOADER_SRC = f"{APP_URL}/static/whatsapp-widget.js?shop="
+# Every storefront page view runs the loader, so browsers and CDNs may cache
+# its config for WIDGET_CONFIG_MAX_AGE seconds; a saved change shows up once
+# that expires. The loader runs on the shop's own (possibly custom) domain,
+# which the CORS origin regex can't enumerate, and the GET carries no
+# credentials, so any origin may read it.
+WIDGET_CONFIG_MAX_AGE = int(os.getenv("WIDGET_CONFIG_MAX_AGE", 300))
+_WIDGET_CONFIG_HEADERS = {
+    "Cache-Control": f"public, max-age={WIDGET_CONFIG_MAX_AGE}",
+    "Access-Control-Allow-Origin": "*",
+}
+# Phone numbers: optional leading +, then 6-20 digits/dashes/spaces that start
+# and end with a digit.
+_PHONE_RE = re.compile(r"\+?\d[\d\- ]{4,18}\d")
+
+# Content Security Policy for the embedded admin pages
+_CSP = (
+    "frame-ancestors https://*.myshopify.com https://admin.shopify.com; "
+    "default-src 'self' https://cdn.shopify.com https://*.myshopify.com; "
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.shopify.com; "
+    "style-src 'self' 'unsafe-inline' https://cdn.shopify.com; "
+    "img-src 'self' data: https:; "
+    "font-src 'self' https://cdn.shopify.com; "
+    "connect-src 'self' https://*.myshopify.com https://admin.shopify.com"
+)
+
+# Encoded once for the HMAC verifiers instead of on every request
+_SECRET_BYTES = SHOPIFY_API_SECRET.encode("utf-8")
+
+log = logging.getLogger(__name__)
+
 # Database
-from database import db
+from database import db, SQLAlchemyDB
+
+# Every db call goes through run_db. SQLAlchemyDB calls wait on database
+# round trips, so they run in the threadpool. SimpleFileDB calls update memory
+# under a lock its flush thread holds only to swap out pending records, never
+# across a write or fsync, so they run inline. Any other blocking file I/O
+# belongs in the threadpool, never on the event loop.
+_DB_IN_THREADPOOL = isinstance(db, SQLAlchemyDB)
+
+async def run_db(fn, *args):
+    """Call a blocking db method without stalling the event loop"""
+    if _DB_IN_THREADPOOL:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+@app.on_event("startup")
+async def start_logging():
+    # Handlers only enqueue records; a listener thread does the stderr writes,
+    # so request handlers never block on the stream lock
+    log_queue = queue.Queue(-1)
+    app.state.log_listener = logging.handlers.QueueListener(
+        log_queue, logging.StreamHandler(sys.stderr), respect_handler_level=True
+    )
+    app.state.log_handler = logging.handlers.QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(app.state.log_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+    # httpx logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    app.state.log_listener.start()
+
+@app.on_event("shutdown")
+async def stop_logging():
+    logging.getLogger().removeHandler(app.state.log_handler)
+    app.state.log_listener.stop()
+
+@app.on_event("startup")
+async def open_http_client():
+    # One pooled client for all Shopify calls: keep-alive and HTTP/2 reuse the
+    # TLS session to each *.myshopify.com host instead of handshaking per call
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        # Shopify calls sit inside request handlers; fail them well before
+        # the client gives up on us
+        timeout=httpx.Timeout(10.0, connect=5.0),
+        limits=httpx.Limits(max_keepalive_connections=100),
+    )
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await app.state.http.aclose()
+
+# With several workers the install/session-token caches and click counters
+# live in Redis (REDIS_URL) so every worker shares them; without it they are
+# per-process. Redis errors degrade to a cache miss or the local counter.
+REDIS_URL = os.getenv("REDIS_URL")
+_redis = None
+
+@app.on_event("startup")
+async def open_redis():
+    global _redis
+    if REDIS_URL:
+        import redis.asyncio
+        _redis = redis.asyncio.Redis.from_url(REDIS_URL)
+
+async def cache_get(key: str) -> Optional[bytes]:
+    try:
+        return await _redis.get(key)
+    except Exception as e:
+        log.warning("Error reading cache: %s", e)
+        return None
+
+async def cache_set(key: str, value: bytes, ttl: int):
+    try:
+        await _redis.set(key, value, ex=ttl)
+    except Exception as e:
+        log.warning("Error writing cache: %s", e)
+
+# Widget clicks are only ever read as per-shop totals, so they are counted in
+# memory (or a Redis hash) and written in one batch every CLICK_FLUSH_INTERVAL
+# seconds. A crash loses at most one interval of in-memory clicks.
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "5"))
+_click_buffer: Counter = Counter()
+
+async def count_click(shop: str):
+    if _redis is not None:
+        try:
+            await _redis.hincrby("clicks", shop, 1)
+            return
+        except Exception as e:
+            log.warning("Error counting click in Redis: %s", e)
+    _click_buffer[shop] += 1
+
+async def drop_clicks(shop: str):
+    """Discard a shop's buffered clicks, e.g. once it uninstalls"""
+    _click_buffer.pop(shop, None)
+    if _redis is not None:
+        try:
+            await _redis.hdel("clicks", shop)
+        except Exception as e:
+            log.warning("Error dropping shared click counter: %s", e)
+
+async def flush_clicks():
+    """Swap out the click buffer and write it to the database"""
+    global _click_buffer
+    # No await between reading and replacing the buffer, so no click
+    # recorded on the event loop can fall between the two
+    clicks, _click_buffer = _click_buffer, Counter()
+    if _redis is not None:
+        # HGETALL + DEL in one MULTI/EXEC, so whichever worker flushes takes
+        # the shared counters exactly once
+        try:
+            async with _redis.pipeline(transaction=True) as pipe:
+                shared, _ = await pipe.hgetall("clicks").delete("clicks").execute()
+            clicks.update({shop.decode(): int(n) for shop, n in shared.items()})
+        except Exception as e:
+            log.warning("Error reading shared click counters: %s", e)
+    if clicks:
+        try:
+            await run_db(db.log_widget_clicks_bulk, dict(clicks))
+        except Exception as e:
+            log.warning("Error flushing widget clicks: %s", e)
+            # Keep them for the next flush; the shared counters were
+            # already deleted, so this buffer is their only copy now
+            _click_buffer.update(clicks)
+
+async def _flush_clicks_loop():
+    while True:
+        await asyncio.sleep(CLICK_FLUSH_INTERVAL)
+        await flush_clicks()
+
+@app.on_event("startup")
+async def start_click_flusher():
+    app.state.click_flusher = asyncio.create_task(_flush_clicks_loop())
+
+@app.on_event("shutdown")
+async def stop_click_flusher():
+    app.state.click_flusher.cancel()
+    await flush_clicks()
+
+@app.on_event("shutdown")
+async def close_redis():
+    if _redis is not None:
+        await _redis.aclose()
+
+# Installation rows are cached by db's read cache. Concurrent misses for the
+# same shop share one in-flight lookup rather than each querying the database.
+_install_lookups: Dict[str, asyncio.Future] = {}
+
+async def get_installation_cached(shop: str) -> Optional[dict]:
+    """db.get_installation with concurrent lookups for a shop coalesced"""
+    if not _DB_IN_THREADPOOL:
+        return await run_db(db.get_installation, shop)
+    lookup = _install_lookups.get(shop)
+    if lookup is None:
+        lookup = asyncio.ensure_future(run_db(db.get_installation, shop))
+        _install_lookups[shop] = lookup
+        lookup.add_done_callback(lambda _: _install_lookups.pop(shop, None))
+    # Shielded so one cancelled request doesn't cancel the others' lookup
+    return await asyncio.shield(lookup)
 
 def verify_shopify_webhook(data, hmac_header):
     """Verify Shopify webhook signature"""
-    calculated_hmac = base64.b64encode(
-        hmac.new(
-            SHOPIFY_API_SECRET.encode('utf-8'),
-            data,
-            digestmod=hashlib.sha256
-        ).digest()
-    ).decode()
-    return hmac.compare_digest(calculated_hmac, hmac_header)
+    # Decode the ~44-byte header rather than base64-encoding our digest
+    try:
+        expected = base64.b64decode(hmac_header, validate=True)
+    except (ValueError, TypeError):
+        # Malformed or missing header
+        return False
+    calculated_hmac = hmac.digest(_SECRET_BYTES, data, "sha256")
+    return hmac.compare_digest(calculated_hmac, expected)
 
 def verify_shopify_request(request: Request):
     """Verify embedded app request from Shopify"""
     shop = request.query_params.get("shop")
-    hmac_param = request.query_params.get("hmac")
+    
+    # Canonical string: every param except hmac/signature, sorted. One pass
+    # over the multi-dict picks out hmac and collects the rest; copying it
+    # into a dict would also drop repeated keys
+    hmac_param = None
+    pairs = []
+    for k, v in request.query_params.multi_items():
+        if k == "hmac":
+            hmac_param = v
+        elif k != "signature":
+            pairs.append((k, v))
     
     if not shop or not hmac_param:
         return None
     
-    # Create query string without hmac for verification
-    query_params = dict(request.query_params)
-    query_params.pop("hmac", None)
-    query_params.pop("signature", None)
-    
-    # Sort parameters and create query string
-    sorted_params = sorted(query_params.items())
-    query_string = "&".join([f"{k}={v}" for k, v in sorted_params])
+    pairs.sort()
+    query_string = "&".join(map("=".join, pairs))
     
     # Calculate HMAC
-    calculated_hmac = hmac.new(
-        SHOPIFY_API_SECRET.encode('utf-8'),
-        query_string.encode('utf-8'),
-        digestmod=hashlib.sha256
-    ).hexdigest()
+    calculated_hmac = hmac.digest(_SECRET_BYTES, query_string.encode('utf-8'), "sha256").hex()
     
     if hmac.compare_digest(calculated_hmac, hmac_param):
         return shop
     return None
 
-def verify_session_token(session_token: str):
+# blake2b(token) -> (shop, exp) for verified session tokens
+_session_token_cache = TTLCache(maxsize=50_000, ttl=60)
+
+# Three base64url segments; anything else is rejected before hashing or
+# decoding. Real session tokens are well under the length cap.
+_JWT_SHAPE = re.compile(r"[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+")
+_JWT_MAX_LENGTH = 4096
+
+async def verify_session_token(session_token: str):
     """Verify Shopify session token for embedded apps (App Bridge 3.0)"""
     try:
         # Handle development tokens
@@ -94,38 +311,80 @@ def verify_session_token(session_token: str):
         if session_token == "dev-token" or session_token == "fallback-token":
             return None
         
-        # Decode without verification first to get the shop
-        unverified = jwt.decode(session_token, options={"verify_signature": False})
-        dest = unverified.get("dest", "")
+        if len(session_token) >= _JWT_MAX_LENGTH or not _JWT_SHAPE.fullmatch(session_token):
+            return None
         
-        # Extract shop from dest (format: https://shop.myshopify.com/admin)
-        if dest:
-            shop = dest.replace("https://", "").replace("http://", "").replace("/admin", "").split("/")[0]
+        # App Bridge reuses a token for all calls within its ~60s lifetime, so
+        # skip the HMAC and JSON work for tokens we've already verified
+        cache_key = hashlib.blake2b(session_token.encode(), digest_size=16).digest()
+        if _redis is None:
+            cached = _session_token_cache.get(cache_key)
+            if cached and cached[1] > time.time():
+                return cached[0]
         else:
-            # Fallback: try to get from iss
-            iss = unverified.get("iss", "")
-            shop = iss.replace("https://", "").replace("http://", "").split("/")[0] if iss else None
+            # Redis expires the entry with the token, so a hit is still valid
+            cached = await cache_get(f"jwt:{cache_key.hex()}")
+            if cached is not None:
+                return cached.decode()
         
-        if not shop:
-            return None
-        
-        # Verify with secret (App Bridge 3.0 uses API secret)
+        # Verify with secret (App Bridge 3.0 uses API secret). One decode does
+        # it all: the shop is read from the verified payload afterwards.
         payload = jwt.decode(
             session_token,
-            SHOPIFY_API_SECRET,
+            _SECRET_BYTES,
             algorithms=["HS256"],
-            audience=SHOPIFY_API_KEY
+            audience=SHOPIFY_API_KEY,
+            leeway=5,
+            options={"require": ["exp", "aud", "iss", "nbf", "dest"]}
         )
+        # Extract shop from dest (format: https://shop.myshopify.com); iss
+        # must be the same shop's admin (https://shop.myshopify.com/admin).
+        # The claims are verified, so plain string checks are enough.
+        dest = payload["dest"]
+        if not dest.startswith("https://") or payload["iss"] != dest + "/admin":
+            return None
+        shop = dest.removeprefix("https://")
         
+        if _redis is None:
+            _session_token_cache[cache_key] = (shop, payload["exp"])
+        else:
+            ttl = int(payload["exp"] - time.time())
+            if ttl > 0:
+                await cache_set(f"jwt:{cache_key.hex()}", shop.encode(), ttl)
         return shop
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    except (AttributeError, TypeError):
+        # dest/iss that aren't strings
+        return None
     except Exception as e:
-        print(f"Error verifying session token: {e}")
+        log.warning("Error verifying session token: %s", e)
         return None
 
+async def get_session_shop(authorization: Optional[str] = Header(None)) -> Optional[str]:
+    """Shop from a valid App Bridge session token in the Authorization header, if any"""
+    if authorization and authorization.startswith("Bearer "):
+        return await verify_session_token(authorization.removeprefix("Bearer "))
+    return None
+
+async def get_verified_shop(request: Request, shop: Optional[str] = Depends(get_session_shop)) -> str:
+    """Shop from the session token, falling back to ?shop= for an installed
+    shop (development); 401 when neither is present"""
+    if not shop:
+        shop = request.query_params.get("shop")
+        if shop and not await get_installation_cached(shop):
+            shop = None
+    
+    if not shop:
+        raise HTTPException(status_code=401, detail="Missing or invalid session token")
+    return shop
+
+async def read_json(request: Request):
+    """Parse the request body with orjson (faster than Starlette's stdlib request.json())"""
+    return orjson.loads(await request.body())
+
 @app.get("/")
 async def root():
     return {"message": "Shopify WhatsApp Launcher App"}
@@ -140,7 +399,7 @@ async def install(shop: str):
     params = {
         "client_id": SHOPIFY_API_KEY,
         "scope": SHOPIFY_SCOPES,
-        "redirect_uri": f"{APP_URL}/auth/callback",
+        "redirect_uri": _OAUTH_REDIRECT_URI,
         "state": shop
     }
     
@@ -151,7 +410,7 @@ async def install(shop: str):
 @app.get("/auth/callback")
 async def auth_callback(request: Request):
     """Handle Shopify OAuth callback"""
-    query_params = dict(request.query_params)
+    query_params = request.query_params
     
     if "error" in query_params:
         raise HTTPException(status_code=400, detail="Authorization denied")
@@ -169,7 +428,7 @@ async def auth_callback(request: Request):
         "code": code
     }
     
-    response = requests.post(
+    response = await app.state.http.post(
         f"https://{shop}/admin/oauth/access_token",
         json=token_data
     )
@@ -177,22 +436,22 @@ async def auth_callback(request: Request):
     if response.status_code != 200:
         raise HTTPException(status_code=400, detail="Failed to get access token")
     
-    access_token = response.json()["access_token"]
+    access_token = orjson.loads(response.content)["access_token"]
     
     # Store installation
-    db.save_installation(shop, access_token)
+    await run_db(db.save_installation, shop, access_token)
     
     return RedirectResponse(url=f"/dashboard?shop={shop}")
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request, shop: str):
     """Main dashboard for WhatsApp configuration"""
-    installation = db.get_installation(shop)
+    installation = await get_installation_cached(shop)
     if not installation:
         return RedirectResponse(url=f"/install?shop={shop}")
-    # if not shop_has_active_subscription(shop):
+    # if not await shop_has_active_subscription(shop):
     #     return RedirectResponse(url=f"/pricing?shop={shop}")
-    current_config = db.get_whatsapp_config(shop) or {}
+    current_config = await run_db(db.get_whatsapp_config, shop) or {}
     
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
@@ -215,7 +474,7 @@ async def embedded_app(request: Request):
         raise HTTPException(status_code=401, detail="Invalid request")
     
     # Check if app is installed
-    installation = db.get_installation(shop)
+    installation = await get_installation_cached(shop)
     if not installation:
         # Redirect to installation
         return templates.TemplateResponse("install_embedded.html", {
@@ -226,7 +485,7 @@ async def embedded_app(request: Request):
             "app_url": APP_URL
         })
     
-    current_config = db.get_whatsapp_config(shop) or {}
+    current_config = await run_db(db.get_whatsapp_config, shop) or {}
     
     # Create response with CSP headers for embedded app
     response = templates.TemplateResponse("embedded_dashboard.html", {
@@ -239,51 +498,38 @@ async def embedded_app(request: Request):
     })
     
     # Add Content Security Policy for embedded apps
-    response.headers["Content-Security-Policy"] = (
-        "frame-ancestors https://*.myshopify.com https://admin.shopify.com; "
-        "default-src 'self' https://cdn.shopify.com https://*.myshopify.com; "
-        "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.shopify.com; "
-        "style-src 'self' 'unsafe-inline' https://cdn.shopify.com; "
-        "img-src 'self' data: https:; "
-        "font-src 'self' https://cdn.shopify.com; "
-        "connect-src 'self' https://*.myshopify.com https://admin.shopify.com"
-    )
+    response.headers["Content-Security-Policy"] = _CSP
     
     return response
 
 @app.post("/api/configure-whatsapp")
 async def api_configure_whatsapp(
     request: Request,
-    authorization: Optional[str] = Header(None)
+    shop: Optional[str] = Depends(get_session_shop)
 ):
     """API endpoint for embedded app WhatsApp configuration with App Bridge 3.0"""
-    shop = None
-    
-    # Try to get session token from Authorization header (App Bridge 3.0)
-    if authorization and authorization.startswith("Bearer "):
-        session_token = authorization.replace("Bearer ", "")
-        shop = verify_session_token(session_token)
+    # Parse the body once; both the dev fallback and the settings read it
+    try:
+        form_data = await read_json(request)
+    except orjson.JSONDecodeError:
+        form_data = {}
+    if not isinstance(form_data, dict):
+        form_data = {}
     
     # Fallback: try to get shop from request body (for development/testing)
     if not shop:
-        try:
-            form_data = await request.json()
-            shop = form_data.get("shop")
-            # Only allow if app is installed (security check)
-            if shop and not db.get_installation(shop):
-                shop = None
-        except:
-            pass
+        shop = form_data.get("shop")
+        # Only allow if app is installed (security check)
+        if shop and not await get_installation_cached(shop):
+            shop = None
     
     if not shop:
         raise HTTPException(status_code=401, detail="Missing or invalid session token")
     
-    installation = db.get_installation(shop)
+    installation = await get_installation_cached(shop)
     if not installation:
         raise HTTPException(status_code=401, detail="App not installed")
     
-    # Get form data
-    form_data = await request.json()
     phone_number = form_data.get("phone_number")
     initial_message = form_data.get("initial_message")
     
@@ -291,42 +537,26 @@ async def api_configure_whatsapp(
         raise HTTPException(status_code=400, detail="Missing required fields")
     
     # Validate phone number (basic validation)
-    if not phone_number.replace("+", "").replace("-", "").replace(" ", "").isdigit():
+    if not _PHONE_RE.fullmatch(phone_number):
         raise HTTPException(status_code=400, detail="Invalid phone number format")
     
     # Store configuration
-    db.save_whatsapp_config(shop, phone_number, initial_message)
+    await run_db(db.save_whatsapp_config, shop, phone_number, initial_message)
     
     # Install script tag in Shopify store
     try:
-        await install_script_tag(shop)
+        await install_script_tag(shop, installation)
     except Exception as e:
-        print(f"Error installing script tag: {e}")
+        log.warning("Error installing script tag: %s", e)
         # Don't fail the request if script tag installation fails
     
-    return JSONResponse({"success": True, "message": "Configuration saved successfully"})
+    return ORJSONResponse({"success": True, "message": "Configuration saved successfully"})
 
 @app.get("/api/config")
-async def get_config(request: Request, authorization: Optional[str] = Header(None)):
+async def get_config(shop: str = Depends(get_verified_shop)):
     """Get current WhatsApp configuration for embedded app with App Bridge 3.0"""
-    shop = None
-    
-    # Try to get session token from Authorization header
-    if authorization and authorization.startswith("Bearer "):
-        session_token = authorization.replace("Bearer ", "")
-        shop = verify_session_token(session_token)
-    
-    # Fallback: try to get shop from query params (for development)
-    if not shop:
-        shop = request.query_params.get("shop")
-        if shop and not db.get_installation(shop):
-            shop = None
-    
-    if not shop:
-        raise HTTPException(status_code=401, detail="Missing or invalid session token")
-    
-    config = db.get_whatsapp_config(shop) or {}
-    return JSONResponse(config)
+    config = await run_db(db.get_whatsapp_config, shop) or {}
+    return ORJSONResponse(config)
 
 @app.get("/api/config-fallback")
 async def get_config_fallback(shop: str):
@@ -335,12 +565,21 @@ async def get_config_fallback(shop: str):
         raise HTTPException(status_code=400, detail="Shop parameter required")
     
     # Verify the shop has the app installed
-    installation = db.get_installation(shop)
+    installation = await get_installation_cached(shop)
     if not installation:
         raise HTTPException(status_code=401, detail="App not installed")
     
-    config = db.get_whatsapp_config(shop) or {}
-    return JSONResponse(config)
+    config = await run_db(db.get_whatsapp_config, shop) or {}
+    return ORJSONResponse(config)
+
+@app.get("/api/widget-config")
+async def get_widget_config(shop: str):
+    """Public widget settings for the storefront loader (static/whatsapp-widget.js)"""
+    config = await run_db(db.get_whatsapp_config, shop) or {}
+    return ORJSONResponse(
+        {"phone_number": config.get("phone_number"), "initial_message": config.get("initial_message")},
+        headers=_WIDGET_CONFIG_HEADERS,
+    )
 
 @app.post("/configure-whatsapp")
 async def configure_whatsapp(
@@ -349,25 +588,25 @@ async def configure_whatsapp(
     initial_message: str = Form(...)
 ):
     """Configure WhatsApp settings"""
-    installation = db.get_installation(shop)
+    installation = await get_installation_cached(shop)
     if not installation:
         raise HTTPException(status_code=401, detail="App not installed")
     
     # Validate phone number (basic validation)
-    if not phone_number.replace("+", "").replace("-", "").replace(" ", "").isdigit():
+    if not _PHONE_RE.fullmatch(phone_number):
         raise HTTPException(status_code=400, detail="Invalid phone number format")
     
     # Store configuration
-    db.save_whatsapp_config(shop, phone_number, initial_message)
+    await run_db(db.save_whatsapp_config, shop, phone_number, initial_message)
     
     # Install script tag in Shopify store
-   # await install_script_tag(shop)
+   # await install_script_tag(shop, installation)
     
     return RedirectResponse(url=f"/dashboard?shop={shop}&success=1", status_code=303)
 @app.get("/debug/script-tags/{shop}")
 async def debug_script_tags(shop: str):
     """Debug endpoint to check script tags"""
-    installation = db.get_installation(shop)
+    installation = await get_installation_cached(shop)
     if not installation:
         return {"error": "App not installed"}
     
@@ -378,13 +617,13 @@ async def debug_script_tags(shop: str):
     }
     
     try:
-        response = requests.get(
-            f"https://{shop}/admin/api/2023-10/script_tags.json",
+        response = await app.state.http.get(
+            _SCRIPT_TAGS_URL(shop),
             headers=headers
         )
         
         if response.status_code == 200:
-            script_tags = response.json().get("script_tags", [])
+            script_tags = orjson.loads(response.content).get("script_tags", [])
             return {
                 "status": "success",
                 "count": len(script_tags),
@@ -402,132 +641,98 @@ async def debug_script_tags(shop: str):
             }
     except Exception as e:
         return {"status": "error", "message": str(e)}
-async def install_script_tag(shop: str):
-    """Install script tag in Shopify store"""
-    installation = db.get_installation(shop)
-    if not installation:
+
+SCRIPT_TAG_CREATE_MUTATION = """
+mutation scriptTagCreate($input: ScriptTagInput!) {
+  scriptTagCreate(input: $input) {
+    scriptTag { id }
+    userErrors { field message }
+  }
+}
+"""
+
+async def install_script_tag(shop: str, installation: dict):
+    """Install script tag in Shopify store using the caller's installation row"""
+    if installation.get("script_tag_installed"):
         return
     
     access_token = installation["access_token"]
     
-    script_tag_data = {
-        "script_tag": {
-            "event": "onload",
-            "src": f"{APP_URL}/whatsapp-widget.js?shop={shop}"
-        }
-    }
-    
     headers = {
         "X-Shopify-Access-Token": access_token,
         "Content-Type": "application/json"
     }
     
-    # Check if script tag already exists
-    response = requests.get(
-        f"https://{shop}/admin/api/2023-10/script_tags.json",
-        headers=headers
+    src = _WIDGET_LOADER_SRC + shop
+    
+    # Create the tag in a single GraphQL call instead of listing every script
+    # tag first; a duplicate is reported as a userError and ignored
+    response = await app.state.http.post(
+        _GRAPHQL_URL(shop),
+        headers=headers,
+        json={
+            "query": SCRIPT_TAG_CREATE_MUTATION,
+            "variables": {
+                "input": {
+                    "src": src,
+                    "displayScope": "ONLINE_STORE"
+                }
+            }
+        }
     )
-    
-    existing_scripts = response.json().get("script_tags", [])
-    widget_script_exists = any(
-        script.get("src", "").startswith(f"{APP_URL}/whatsapp-widget.js")
-        for script in existing_scripts
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    if data.get("errors"):
+        log.warning("scriptTagCreate rejected, falling back to REST: %s", data["errors"])
+        await create_script_tag_rest(shop, headers, src)
+    else:
+        user_errors = data["data"]["scriptTagCreate"]["userErrors"]
+        if user_errors and not all("already exists" in e.get("message", "") for e in user_errors):
+            raise Exception(f"scriptTagCreate failed: {user_errors}")
+    
+    await run_db(db.set_script_tag_installed, shop, True)
+
+async def create_script_tag_rest(shop: str, headers: Dict[str, str], src: str):
+    """Create the script tag through the REST API without listing existing tags first"""
+    response = await app.state.http.post(
+        _SCRIPT_TAGS_URL(shop),
+        headers=headers,
+        json={"script_tag": {"event": "onload", "src": src}}
     )
-    
-    if not widget_script_exists:
-        requests.post(
-            f"https://{shop}/admin/api/2023-10/script_tags.json",
-            headers=headers,
-            json=script_tag_data
-        )
+    # A duplicate src comes back as 422 "has already been taken"
+    if response.status_code == 422 and (b"taken" in response.content or b"exists" in response.content):
+        return
+    response.raise_for_status()
 
 @app.get("/whatsapp-widget.js")
 async def whatsapp_widget(shop: str):
-    """Serve WhatsApp widget JavaScript"""
-    config = db.get_whatsapp_config(shop)
-    
-    if not config:
-        return ""
-    
-    phone_number = config["phone_number"].replace("+", "").replace("-", "").replace(" ", "")
-    initial_message = config["initial_message"]
-    
-    js_code = f"""
-    (function() {{
-    document.addEventListener("DOMContentLoaded", function() {{
-        // Create WhatsApp widget
-        const whatsappWidget = document.createElement('div');
-        whatsappWidget.id = 'whatsapp-widget';
-        whatsappWidget.innerHTML = `
-            <div style="
-                position: fixed;
-                bottom: 20px;
-                right: 20px;
-                width: 60px;
-                height: 60px;
-                background-color: #25D366;
-                border-radius: 50%;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                cursor: pointer;
-                box-shadow: 0 4px 12px rgba(0,0,0,0.15);
-                z-index: 9999;
-                transition: transform 0.3s ease;
-            " onmouseover="this.style.transform='scale(1.1)'" onmouseout="this.style.transform='scale(1)'">
-                <svg width="30" height="30" viewBox="0 0 24 24" fill="white">
-                    <path d="M17.472 14.382c-.297-.149-1.758-.867-2.03-.967-.273-.099-.471-.148-.67.15-.197.297-.767.966-.94 1.164-.173.199-.347.223-.644.075-.297-.15-1.255-.463-2.39-1.475-.883-.788-1.48-1.761-1.653-2.059-.173-.297-.018-.458.13-.606.134-.133.298-.347.446-.52.149-.174.198-.298.298-.497.099-.198.05-.371-.025-.52-.075-.149-.669-1.612-.916-2.207-.242-.579-.487-.5-.669-.51-.173-.008-.371-.01-.57-.01-.198 0-.52.074-.792.372-.272.297-1.04 1.016-1.04 2.479 0 1.462 1.065 2.875 1.213 3.074.149.198 2.096 3.2 5.077 4.487.709.306 1.262.489 1.694.625.712.227 1.36.195 1.871.118.571-.085 1.758-.719 2.006-1.413.248-.694.248-1.289.173-1.413-.074-.124-.272-.198-.57-.347m-5.421 7.403h-.004a9.87 9.87 0 01-5.031-1.378l-.361-.214-3.741.982.998-3.648-.235-.374a9.86 9.86 0 01-1.51-5.26c.001-5.45 4.436-9.884 9.888-9.884 2.64 0 5.122 1.03 6.988 2.898a9.825 9.825 0 012.893 6.994c-.003 5.45-4.437 9.884-9.885 9.884m8.413-18.297A11.815 11.815 0 0012.05 0C5.495 0 .16 5.335.157 11.892c0 2.096.547 4.142 1.588 5.945L.057 24l6.305-1.654a11.882 11.882 0 005.683 1.448h.005c6.554 0 11.89-5.335 11.893-11.893A11.821 11.821 0 0020.885 3.488"/>
-                </svg>
-            </div>
-        `;
-
-        whatsappWidget.onclick = function() {{
-            const message = encodeURIComponent("{initial_message}");
-            const whatsappUrl = `https://wa.me/{phone_number}?text=${{message}}`;
-            window.open(whatsappUrl, '_blank');
-        }};
-
-        document.body.appendChild(whatsappWidget);
-    }});
-}})();
-
-"""
-    
-    return HTMLResponse(content=js_code, media_type="application/javascript")
+    """Redirect script tags installed before the static loader
+    (static/whatsapp-widget.js) to it"""
+    return RedirectResponse(
+        url="/static/whatsapp-widget.js?" + urlencode({"shop": shop}),
+        status_code=302,
+        headers={"Cache-Control": "public, max-age=300"},
+    )
 
 @app.post("/api/widget-click")
-async def widget_click(request: Request):
+async def widget_click(request: Request, background_tasks: BackgroundTasks):
     """Track widget clicks for analytics"""
     try:
-        data = await request.json()
+        data = await read_json(request)
         shop = data.get("shop")
         if shop:
-            db.log_widget_click(shop)
-        return JSONResponse({"success": True})
+            # Counted after the response is sent; with REDIS_URL set this is
+            # a network round trip the storefront doesn't need to wait for
+            background_tasks.add_task(count_click, shop)
+        return ORJSONResponse({"success": True})
     except Exception:
-        return JSONResponse({"success": False})
+        return ORJSONResponse({"success": False})
 
 @app.get("/api/analytics")
-async def get_analytics(request: Request, authorization: Optional[str] = Header(None)):
+async def get_analytics(shop: str = Depends(get_verified_shop)):
     """Get analytics data for embedded app with App Bridge 3.0"""
-    shop = None
-    
-    # Try to get session token from Authorization header
-    if authorization and authorization.startswith("Bearer "):
-        session_token = authorization.replace("Bearer ", "")
-        shop = verify_session_token(session_token)
-    
-    # Fallback: try to get shop from query params (for development)
-    if not shop:
-        shop = request.query_params.get("shop")
-        if shop and not db.get_installation(shop):
-            shop = None
-    
-    if not shop:
-        raise HTTPException(status_code=401, detail="Missing or invalid session token")
-    
-    analytics = db.get_analytics(shop)
-    return JSONResponse(analytics)
+    analytics = await run_db(db.get_analytics, shop)
+    return ORJSONResponse(analytics)
 
 @app.post("/webhooks/app/uninstalled")
 async def app_uninstalled(request: Request, x_shopify_hmac_sha256: str = Header(None)):
@@ -538,14 +743,15 @@ async def app_uninstalled(request: Request, x_shopify_hmac_sha256: str = Header(
         raise HTTPException(status_code=401, detail="Invalid webhook signature")
     
     try:
-        data = json.loads(body)
+        data = orjson.loads(body)
         shop = data.get("domain")
         if shop:
-            db.remove_installation(shop)
+            await run_db(db.remove_installation, shop)
+            await drop_clicks(shop)
     except Exception as e:
-        print(f"Error handling uninstall webhook: {e}")
+        log.warning("Error handling uninstall webhook: %s", e)
     
-    return JSONResponse({"success": True})
+    return ORJSONResponse({"success": True})
 
 @app.get("/health")
 async def health_check():
@@ -564,8 +770,8 @@ async def pricing(shop: str):
     if not shop:
         raise HTTPException(status_code=400, detail="Shop parameter required")
     return RedirectResponse(url=plan_selection_url(shop))
-def shop_has_active_subscription(shop: str) -> bool:
-    installation = db.get_installation(shop)
+async def shop_has_active_subscription(shop: str) -> bool:
+    installation = await get_installation_cached(shop)
     if not installation:
         return False
     access_token = installation["access_token"]
@@ -579,20 +785,28 @@ def shop_has_active_subscription(shop: str) -> bool:
       }
     }
     """
-    r = requests.post(
-        f"https://{shop}/admin/api/2023-10/graphql.json",
+    r = await app.state.http.post(
+        _GRAPHQL_URL(shop),
         headers={
             "X-Shopify-Access-Token": access_token,
             "Content-Type": "application/json",
         },
         json={"query": query},
-        timeout=20,
     )
-    data = r.json()
+    data = orjson.loads(r.content)
     subs = (data.get("data", {}) or {}).get("currentAppInstallation", {}).get("activeSubscriptions", [])
     return any(s.get("status") in ("ACTIVE", "TRIAL") for s in subs)
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # The JSON file backend is owned by a single process, so it only scales
+    # out with DB_BACKEND=postgres. Caches and the click buffer are per worker.
+    if os.getenv("DB_BACKEND", "file") == "postgres":
+        # Each worker opens its own connection pools (see database.py), so
+        # keep the default small rather than one per CPU
+        workers = int(os.getenv("WEB_CONCURRENCY", 2))
+    else:
+        workers = 1
+    # "auto" picks uvloop and httptools when installed (uvicorn[standard])
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="auto", http="auto", workers=workers)
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from database import SimpleFileDB
+
+
+class SimpleFileDBLogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_file = os.path.join(self.tmp.name, "app_data.json")
+
+    def test_writes_after_torn_log_tail_survive_reload(self):
+        db = SimpleFileDB(self.db_file)
+        db.save_installation("a.myshopify.com", "token-a")
+        db.flush()
+
+        # Crash mid-append: a record without its closing bytes or newline
+        with open(db.log_file, "ab") as f:
+            f.write(b'{"op":"installations","shop":"x.myshopify.com","val')
+
+        db = SimpleFileDB(self.db_file)
+        self.assertEqual(list(db.get_all_installations()), ["a.myshopify.com"])
+        db.save_installation("b.myshopify.com", "token-b")
+        db.flush()
+        db.save_whatsapp_config("c.myshopify.com", "+1 555 0100", "Hello")
+        db.flush()
+
+        db = SimpleFileDB(self.db_file)
+        self.assertEqual(sorted(db.get_all_installations()), ["a.myshopify.com", "b.myshopify.com"])
+        self.assertEqual(db.get_whatsapp_config("c.myshopify.com")["phone_number"], "+1 555 0100")
+
+
+if __name__ == "__main__":
+    unittest.main()